@@ -0,0 +1,34 @@
+import numpy as np
+
+# Kernel numerico della simulazione idroponica
+# Ordine dei parametri nello stato: ec, ph, water_temp, air_temp, humidity, light
+
+def _step_py(state, delta, lo, hi, cycle, hour, night_light):
+    # Ciclo giornaliero precalcolato: una riga della tabella al posto di
+    # quattro chiamate a sin per tick
+    if 6 <= hour < 18:
+        state[5] = cycle[hour, 0]
+    else:
+        state[5] = night_light
+
+    state[3] = cycle[hour, 1]
+    state[2] = cycle[hour, 2]
+    state[4] = cycle[hour, 3]
+
+    # Correlazioni (EC -> pH, temperatura aria -> umidita') ripiegate nel
+    # delta: i loro limiti coincidono con lo/hi, quindi basta un solo
+    # passaggio di clamp sull'intero stato
+    delta[1] += (state[0] - 1.5) * -0.1
+    delta[4] += (25.0 - state[3]) * 0.5
+
+    for i in range(6):
+        state[i] = min(hi[i], max(lo[i], state[i] + delta[i]))
+
+try:
+    from numba import njit
+    # cache=True salva il codice macchina su disco alla prima esecuzione:
+    # i processi successivi lo ricaricano senza ripagare la compilazione
+    step = njit(cache=True, fastmath=True)(_step_py)
+except ImportError:
+    # Senza numba il kernel gira come normale funzione Python
+    step = _step_py
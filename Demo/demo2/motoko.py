@@ -1,222 +1,369 @@
-import json
 import time
-import random
+import asyncio
+import logging
 from datetime import datetime, timedelta
-import math
+import numpy as np
+import httpx
 from ic.client import Client
-from ic.identity import Identity
+from ic.identity import Identity, Principal
 from ic.agent import Agent
-from ic.candid import Types
+from ic.candid import Types, encode
+
+from kernels import step as _step
+
+log = logging.getLogger(__name__)
+
+# Configurazione della simulazione, congelata a livello di modulo: e' pura
+# costante, non serve riallocarla per ogni istanza. Ordine dei parametri:
+# ec, ph, water_temp, air_temp, humidity, light
+_STATE0 = np.array([1.5, 6.0, 22.0, 25.0, 60.0, 500.0])
+_DRIFT = np.array([0.1, 0.05, 0.2, 0.5, 1.0, 50.0])
+_NOISE = np.array([0.05, 0.02, 0.1, 0.2, 0.5, 20.0])
+_LO = np.array([0.8, 5.5, 18.0, 20.0, 50.0, 100.0])
+_HI = np.array([3.0, 6.5, 26.0, 30.0, 70.0, 1000.0])
+
+def _daily_cycle_table():
+    # Tabella del ciclo giornaliero indicizzata per ora:
+    # (light, air_temp, water_temp, humidity) per ciascuna delle 24 ore
+    day_progress = (np.arange(24) - 6) % 24
+    return np.column_stack((
+        500.0 + 400.0 * np.sin(np.pi * day_progress / 12.0),
+        25.0 + 3.0 * np.sin(np.pi * ((day_progress - 2) % 24) / 12.0),
+        22.0 + 2.0 * np.sin(np.pi * ((day_progress - 4) % 24) / 12.0),
+        60.0 - 5.0 * np.sin(np.pi * day_progress / 12.0)
+    ))
+
+_CYCLE = _daily_cycle_table()
+
+# Drift come processo di Ornstein-Uhlenbeck integrato analiticamente
+# sull'intervallo: statisticamente corretto per qualunque dt (in tick) e
+# una sola estrazione gaussiana per parametro
+_DT = 1.0
+_THETA = _NOISE / _DRIFT
+_OU_DECAY = np.exp(-_THETA * _DT)
+_OU_SIGMA = _NOISE * np.sqrt(2.0 * _THETA * _DT)
 
 class HydroponicSystem:
-    def __init__(self):
-        self.current_state = {
-            'ec': 1.5,          
-            'ph': 6.0,          
-            'water_temp': 22.0,  
-            'air_temp': 25.0,    
-            'humidity': 60.0,    
-            'light': 500.0      
-        }
-        
-        self.variation_params = {
-            'ec': {'drift': 0.1, 'noise': 0.05},
-            'ph': {'drift': 0.05, 'noise': 0.02},
-            'water_temp': {'drift': 0.2, 'noise': 0.1},
-            'air_temp': {'drift': 0.5, 'noise': 0.2},
-            'humidity': {'drift': 1.0, 'noise': 0.5},
-            'light': {'drift': 50.0, 'noise': 20.0}
-        }
-        
-        self.limits = {
-            'ec': {'min': 0.8, 'max': 3.0},
-            'ph': {'min': 5.5, 'max': 6.5},
-            'water_temp': {'min': 18.0, 'max': 26.0},
-            'air_temp': {'min': 20.0, 'max': 30.0},
-            'humidity': {'min': 50.0, 'max': 70.0},
-            'light': {'min': 100.0, 'max': 1000.0}
-        }
-
-    def _apply_daily_cycle(self, hour):
-        day_progress = (hour - 6) % 24
-        if 6 <= hour < 18:
-            light_factor = math.sin(math.pi * day_progress / 12)
-            self.current_state['light'] = 500 + 400 * light_factor
-        else:
-            self.current_state['light'] = random.uniform(0, 10)
-
-        temp_factor = math.sin(math.pi * ((day_progress - 2) % 24) / 12)
-        self.current_state['air_temp'] = 25 + 3 * temp_factor
-
-        water_temp_factor = math.sin(math.pi * ((day_progress - 4) % 24) / 12)
-        self.current_state['water_temp'] = 22 + 2 * water_temp_factor
-
-        humidity_factor = -math.sin(math.pi * day_progress / 12)
-        self.current_state['humidity'] = 60 + 5 * humidity_factor
-
-    def _apply_random_drift(self):
-        for param in self.current_state:
-            drift = self.variation_params[param]['drift']
-            noise = self.variation_params[param]['noise']
-            change = random.uniform(-drift, drift) + random.gauss(0, noise)
-            self.current_state[param] += change
-            self.current_state[param] = max(
-                self.limits[param]['min'],
-                min(self.limits[param]['max'],
-                    self.current_state[param])
-            )
+    def __init__(self, seed=None):
+        # Stato SoA per istanza: il resto e' configurazione condivisa
+        self._state = _STATE0.copy()
+        # Generatore per istanza: niente stato condiviso tra simulatori e
+        # run riproducibili quando si passa un seed
+        self._rng = np.random.default_rng(seed)
 
-    def _apply_correlations(self):
-        ph_change = (self.current_state['ec'] - 1.5) * -0.1
-        self.current_state['ph'] = max(5.5, min(6.5, self.current_state['ph'] + ph_change))
-        
-        humidity_change = (25 - self.current_state['air_temp']) * 0.5
-        self.current_state['humidity'] = max(50, min(70, self.current_state['humidity'] + humidity_change))
-
-    def generate_reading(self):
-        current_hour = datetime.now().hour
-        self._apply_daily_cycle(current_hour)
-        self._apply_random_drift()
-        self._apply_correlations()
-        
-        readings = [
-            {
-                "readingType": "ec",
-                "readingValue": round(self.current_state['ec'], 2),
-                "readingUnit": "mS/cm"
-            },
-            {
-                "readingType": "ph",
-                "readingValue": round(self.current_state['ph'], 2),
-                "readingUnit": "pH"
-            },
-            {
-                "readingType": "water_temperature",
-                "readingValue": round(self.current_state['water_temp'], 2),
-                "readingUnit": "C"
-            },
-            {
-                "readingType": "air_temperature",
-                "readingValue": round(self.current_state['air_temp'], 2),
-                "readingUnit": "C"
-            },
-            {
-                "readingType": "humidity",
-                "readingValue": round(self.current_state['humidity'], 2),
-                "readingUnit": "%"
-            },
-            {
-                "readingType": "light",
-                "readingValue": round(self.current_state['light'], 2),
-                "readingUnit": "PPFD"
-            }
+        # Letture preallocate una volta sola: a ogni tick si aggiorna solo
+        # readingValue, senza ricreare liste e dizionari
+        self._readings = [
+            {"readingType": "ec", "readingValue": 0.0, "readingUnit": "mS/cm"},
+            {"readingType": "ph", "readingValue": 0.0, "readingUnit": "pH"},
+            {"readingType": "water_temperature", "readingValue": 0.0, "readingUnit": "C"},
+            {"readingType": "air_temperature", "readingValue": 0.0, "readingUnit": "C"},
+            {"readingType": "humidity", "readingValue": 0.0, "readingUnit": "%"},
+            {"readingType": "light", "readingValue": 0.0, "readingUnit": "PPFD"}
         ]
-        
-        return readings
+
+        # Prima chiamata a vuoto: compila il kernel (o lo ricarica dalla
+        # cache su disco di numba) prima del primo tick utile
+        _step(self._state.copy(), _DRIFT.copy(), _LO, _HI, _CYCLE, 12, 0.0)
+
+    def generate_reading(self, now=None):
+        # Il chiamante puo' passare il timestamp del tick (gia' letto per il
+        # log) ed evitare una seconda chiamata all'orologio; un datetime
+        # finto rende anche la simulazione deterministica nei test
+        if now is None:
+            now = datetime.now()
+        current_hour = now.hour
+
+        # Passo OU analitico: solo ec e ph rilassano verso il valore di
+        # riposo; gli altri parametri vengono riancorati ogni tick alla base
+        # del ciclo giornaliero dal kernel, quindi un richiamo verso la media
+        # fissa li allontanerebbe sistematicamente dal ciclo — per loro
+        # resta il solo rumore gaussiano
+        delta = _OU_SIGMA * self._rng.standard_normal(6)
+        delta[:2] += (_STATE0[:2] - self._state[:2]) * (1.0 - _OU_DECAY[:2])
+        night_light = self._rng.uniform(0.0, 10.0)
+
+        _step(self._state, delta, _LO, _HI, _CYCLE, current_hour, night_light)
+
+        for i, reading in enumerate(self._readings):
+            reading["readingValue"] = round(self._state[i], 2)
+
+        return self._readings
+
+def _leb128(n):
+    """Codifica un intero senza segno in LEB128"""
+    out = bytearray()
+    while True:
+        byte = n & 0x7f
+        n >>= 7
+        if n:
+            out.append(byte | 0x80)
+        else:
+            out.append(byte)
+            return bytes(out)
+
+ICP_URL = "https://ic0.app"
+
+_CBOR_HEADERS = {'Content-Type': 'application/cbor'}
+
+class PooledClient(Client):
+    """
+    Client ic-py con connessioni persistenti
+
+    La classe base apre una nuova connessione httpx (e quindi un nuovo
+    handshake TCP+TLS) per ogni richiesta; qui una sessione sincrona e una
+    asincrona restano aperte con keep-alive e vengono riusate da tutte le
+    chiamate al boundary node
+    """
+    def __init__(self, url=ICP_URL):
+        super().__init__(url=url)
+        self._session = httpx.Client(timeout=120.0)
+        self._async_session = httpx.AsyncClient(timeout=120.0)
+
+    def _endpoint(self, canister_id, kind):
+        return self.url + '/api/v2/canister/' + str(canister_id) + '/' + kind
+
+    @staticmethod
+    def _timeout(timeout):
+        # timeout=None deve usare il default della sessione, non disattivarlo
+        return httpx.USE_CLIENT_DEFAULT if timeout is None else timeout
+
+    def query(self, canister_id, data, timeout=None):
+        ret = self._session.post(self._endpoint(canister_id, 'query'),
+                                 content=data, headers=_CBOR_HEADERS,
+                                 timeout=self._timeout(timeout))
+        return ret.content
+
+    def call(self, canister_id, req_id, data, timeout=None):
+        self._session.post(self._endpoint(canister_id, 'call'),
+                           content=data, headers=_CBOR_HEADERS,
+                           timeout=self._timeout(timeout))
+        return req_id
+
+    def read_state(self, canister_id, data, timeout=None):
+        ret = self._session.post(self._endpoint(canister_id, 'read_state'),
+                                 content=data, headers=_CBOR_HEADERS,
+                                 timeout=self._timeout(timeout))
+        return ret.content
+
+    def status(self, timeout=None):
+        ret = self._session.get(self.url + '/api/v2/status',
+                                timeout=self._timeout(timeout))
+        return ret.content
+
+    async def query_async(self, canister_id, data, timeout=None):
+        ret = await self._async_session.post(self._endpoint(canister_id, 'query'),
+                                             content=data, headers=_CBOR_HEADERS,
+                                             timeout=self._timeout(timeout))
+        return ret.content
+
+    async def call_async(self, canister_id, req_id, data, timeout=None):
+        await self._async_session.post(self._endpoint(canister_id, 'call'),
+                                       content=data, headers=_CBOR_HEADERS,
+                                       timeout=self._timeout(timeout))
+        return req_id
+
+    async def read_state_async(self, canister_id, data, timeout=None):
+        ret = await self._async_session.post(self._endpoint(canister_id, 'read_state'),
+                                             content=data, headers=_CBOR_HEADERS,
+                                             timeout=self._timeout(timeout))
+        return ret.content
+
+# Un solo client condiviso tra tutte le istanze, cosi' pool di connessioni
+# e sessioni TLS sono comuni all'intero processo
+_http_client = None
+
+def _shared_client():
+    global _http_client
+    if _http_client is None:
+        _http_client = PooledClient(url=ICP_URL)
+    return _http_client
 
 class ICPClient:
     def __init__(self, canister_id):
         # Inizializza il client ICP
-        print(f"Initializing ICP client for canister: {canister_id}")
-        self.client = Client(url="https://ic0.app")
+        log.info("Initializing ICP client for canister: %s", canister_id)
+        self.client = _shared_client()
         self.identity = Identity()
         self.agent = Agent(self.identity, self.client)
         self.canister_id = canister_id
+        # Il principal del canister non cambia: convertilo una volta sola
+        self._canister_str = str(Principal.from_str(canister_id))
+        # Prefissi Candid gia' codificati, per coppia (device_hash, device_key)
+        self._arg_prefix = {}
+
+    def _encode_args(self, device_hash, device_key, readings_text):
+        """Codifica gli argomenti riusando il prefisso costante"""
+        cache_key = (device_hash, device_key)
+        prefix = self._arg_prefix.get(cache_key)
+        if prefix is None:
+            # Codifica un template con testo vuoto: header, tabella dei tipi
+            # e campi costanti non cambiano tra una chiamata e l'altra.
+            # L'ultimo byte e' la lunghezza LEB128 (0) della stringa vuota
+            template = encode([
+                {"type": Types.Text, "value": device_hash},
+                {"type": Types.Text, "value": device_key},
+                {"type": Types.Text, "value": ""}
+            ])
+            prefix = bytes(template[:-1])
+            self._arg_prefix[cache_key] = prefix
+
+        payload = readings_text.encode('utf-8')
+        return prefix + _leb128(len(payload)) + payload
+
+    def _readings_text(self, readings):
+        """Converte le letture in una stringa"""
+        return ",".join(
+            f"type:{reading['readingType']},value:{reading['readingValue']},unit:{reading['readingUnit']}"
+            for reading in readings
+        )
 
     def send_reading(self, device_hash, device_key, readings):
         """Invia i dati usando ic-py"""
-        # Converti le letture in una stringa
-        readings_text = ""
-        first = True
-        for reading in readings:
-            if not first:
-                readings_text += ","
-            readings_text += f"type:{reading['readingType']},value:{reading['readingValue']},unit:{reading['readingUnit']}"
-            first = False
+        readings_text = self._readings_text(readings)
 
         try:
-            from ic.candid import encode
-            from ic.identity import Principal
-            from ic.candid import Types
-
-            # Prepara i parametri nel formato corretto
-            params = [
-                {"type": Types.Text, "value": device_hash},
-                {"type": Types.Text, "value": device_key},
-                {"type": Types.Text, "value": readings_text}
-            ]
-            
             # Codifica gli argomenti
-            args = encode(params)
-            
-            print(f"\nDebug - Sending data to canister {self.canister_id}")
-            print(f"Debug - Method: addReading")
-            print(f"Debug - Device Hash: {device_hash}")
-            print(f"Debug - Key: {device_key}")
-            print(f"Debug - Data: {readings_text}")
-            
-            # Mantieni il canister ID come stringa
-            principal = Principal.from_str(self.canister_id)
-            canister_id_str = str(principal)  # Converti il Principal in stringa
-            
+            args = self._encode_args(device_hash, device_key, readings_text)
+
+            log.debug("Sending data to canister %s", self.canister_id)
+            log.debug("Method: addReading")
+            log.debug("Device Hash: %s", device_hash)
+            log.debug("Key: %s", device_key)
+            log.debug("Data: %s", readings_text)
+
             # Esegui la chiamata al canister
             response = self.agent.update_raw(
-                canister_id_str,  # Usa la stringa invece del Principal
+                self._canister_str,  # Usa la stringa invece del Principal
                 "addReading",
                 args,
                 timeout=30
             )
             
-            print(f"Debug - Response: {response}")
+            log.debug("Response: %s", response)
             return {"success": True, "data": response}
-            
+
         except Exception as e:
-            print(f"Error sending data: {e}")
-            print(f"Full error details: {str(e)}")
-            import traceback
-            print(f"Traceback: {traceback.format_exc()}")
+            log.exception("Error sending data: %s", e)
             return {"success": False, "error": str(e)}
 
-def simulate_readings(device_hash, device_key, canister_id, duration_hours=1, interval_minutes=5):
-    """Simula letture per una durata specificata"""
+    async def send_reading_async(self, device_hash, device_key, readings):
+        """Invia i dati usando l'API asincrona di ic-py"""
+        readings_text = self._readings_text(readings)
+
+        try:
+            args = self._encode_args(device_hash, device_key, readings_text)
+
+            response = await self.agent.update_raw_async(
+                self._canister_str,
+                "addReading",
+                args,
+                timeout=30
+            )
+
+            return {"success": True, "data": response}
+
+        except Exception as e:
+            log.exception("Error sending data: %s", e)
+            return {"success": False, "error": str(e)}
+
+# Numero massimo di chiamate al canister in volo contemporaneamente
+MAX_IN_FLIGHT = 8
+
+async def _simulate(device_hash, device_key, canister_id, duration_hours, interval_minutes):
     system = HydroponicSystem()
     icp_client = ICPClient(canister_id)
-    
+
     start_time = datetime.now()
-    end_time = start_time + timedelta(hours=duration_hours)
-    
-    print(f"Starting simulation at {start_time}")
-    print(f"Will run until {end_time}")
-    print(f"Sending data every {interval_minutes} minutes")
 
-    while datetime.now() < end_time:
-        try:
-            # Genera dati
-            readings = system.generate_reading()
-            
-            print(f"\nTime: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}")
-            for reading in readings:
-                print(f"{reading['readingType']}: {reading['readingValue']} {reading['readingUnit']}")
-            
-            # Invia i dati
-            result = icp_client.send_reading(device_hash, device_key, readings)
-            if result['success']:
-                print("Data sent successfully!")
-            else:
-                print(f"Failed to send data: {result.get('error', 'Unknown error')}")
-            
-            # Attendi per il prossimo ciclo
-            time.sleep(interval_minutes * 60)
-            
-        except KeyboardInterrupt:
-            print("\nSimulation stopped by user")
-            break
-        except Exception as e:
-            print(f"Error in simulation: {e}")
-            print("Waiting before next attempt...")
-            time.sleep(60)
+    log.info("Starting simulation at %s", start_time)
+    log.info("Will run until %s", start_time + timedelta(hours=duration_hours))
+    log.info("Sending data every %s minutes", interval_minutes)
+
+    # Orologio monotonico per la schedulazione: niente oggetti datetime nel
+    # ciclo e niente deriva accumulata tra un tick e l'altro
+    interval = interval_minutes * 60
+    deadline = time.monotonic() + duration_hours * 3600
+
+    queue = asyncio.Queue()
+
+    async def producer():
+        # Genera le letture e le accoda senza bloccarsi sulla rete
+        next_tick = time.monotonic()
+        while time.monotonic() < deadline:
+            try:
+                now = datetime.now()
+                readings = system.generate_reading(now)
+
+                log.info("Time: %s", now.strftime('%Y-%m-%d %H:%M:%S'))
+                for reading in readings:
+                    log.info("%s: %s %s", reading['readingType'],
+                             reading['readingValue'], reading['readingUnit'])
+
+                # In coda va una copia: la lista preallocata viene riusata
+                # al tick successivo e gli invii in ritardo leggerebbero
+                # tutti gli ultimi valori
+                await queue.put([dict(reading) for reading in readings])
+                next_tick += interval
+                await asyncio.sleep(max(0.0, next_tick - time.monotonic()))
+
+            except Exception as e:
+                log.error("Error in simulation: %s", e)
+                log.info("Waiting before next attempt...")
+                next_tick = time.monotonic() + 60
+                await asyncio.sleep(60)
+
+    async def sender():
+        # Svuota la coda a blocchi e invia le chiamate in parallelo
+        while True:
+            batch = [await queue.get()]
+            while len(batch) < MAX_IN_FLIGHT and not queue.empty():
+                batch.append(queue.get_nowait())
+
+            results = await asyncio.gather(
+                *[icp_client.send_reading_async(device_hash, device_key, readings)
+                  for readings in batch],
+                return_exceptions=True
+            )
+
+            for result in results:
+                if isinstance(result, Exception):
+                    log.error("Failed to send data: %s", result)
+                elif result['success']:
+                    log.info("Data sent successfully!")
+                else:
+                    log.error("Failed to send data: %s",
+                              result.get('error', 'Unknown error'))
+
+            for _ in batch:
+                queue.task_done()
+
+    producer_task = asyncio.create_task(producer())
+    sender_task = asyncio.create_task(sender())
+
+    await producer_task
+    await queue.join()
+    sender_task.cancel()
+
+def simulate_readings(device_hash, device_key, canister_id, duration_hours=1, interval_minutes=5):
+    """Simula letture per una durata specificata"""
+    try:
+        # Su Linux uvloop usa io_uring per l'I/O dei socket
+        import uvloop
+        uvloop.install()
+    except ImportError:
+        pass
+
+    try:
+        asyncio.run(_simulate(device_hash, device_key, canister_id,
+                              duration_hours, interval_minutes))
+    except KeyboardInterrupt:
+        log.info("Simulation stopped by user")
 
 if __name__ == "__main__":
+    # Log a livello INFO: le righe di debug dell'invio restano disattivate
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
+
     # Configurazione
     DEVICE_HASH = "mzg4d-slh3z-6rikt-huoiv-r34hy-rpmyb-3c5ce-ybijs-ywz37-jx6tw-saeGrowTow1737022276143932304"
     DEVICE_KEY = "mzg4d-slh3z-6rikt-huoiv-r34hy-rpmyb-3c5ce-ybijs-ywz37-jx6tw-saeGrowTow17370222761439323041737022276143932304"
@@ -231,4 +378,4 @@ if __name__ == "__main__":
             interval_minutes=5
         )
     except KeyboardInterrupt:
-        print("\nSimulation stopped by user")
+        log.info("Simulation stopped by user")
@@ -2,70 +2,103 @@ import os
 import secrets
 import binascii
 import time
-import random
 import math
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta
 
+import numpy as np
+
 from ic.candid import Types, encode
 from ic.client import Client
 from ic.agent import Agent
 from ic.identity import Identity
 
-class HydroponicDataSensor:
-    def __init__(self, base_value, min_value, max_value, volatility=0.1):
+# Tabella del seno a 256 voci con interpolazione lineare: per letture
+# arrotondate a 2 decimali la precisione e' piu' che sufficiente e un
+# accesso in cache L1 sostituisce la chiamata a libm
+_SIN_LUT = np.sin(np.linspace(0.0, 2.0 * np.pi, 257))
+_SIN_SCALE = 256.0 / (2.0 * np.pi)
+
+def _fast_sin(x):
+    i = (x % (2.0 * math.pi)) * _SIN_SCALE
+    i0 = int(i)
+    f = i - i0
+    return _SIN_LUT[i0] + f * (_SIN_LUT[i0 + 1] - _SIN_LUT[i0])
+
+class SensorBank:
+    def __init__(self, base_values, min_values, max_values, volatilities, seed=None):
         """
-        Crea un sensore con andamento realistico
-        
-        :param base_value: Valore centrale
-        :param min_value: Valore minimo
-        :param max_value: Valore massimo
-        :param volatility: Quanto può variare il valore
+        Crea un banco di sensori con andamento realistico
+
+        Lo stato e' tenuto in array NumPy paralleli (un elemento per
+        sensore) cosi' ogni passo aggiorna tutti i sensori in un colpo solo
+
+        :param base_values: Valori centrali
+        :param min_values: Valori minimi
+        :param max_values: Valori massimi
+        :param volatilities: Quanto puo' variare ogni valore
+        :param seed: Seed opzionale per run riproducibili
         """
-        self.base_value = base_value
-        self.min_value = min_value
-        self.max_value = max_value
-        self.volatility = volatility
-        self.current_value = base_value
+        self.base_values = np.asarray(base_values, dtype=np.float64)
+        self.min_values = np.asarray(min_values, dtype=np.float64)
+        self.max_values = np.asarray(max_values, dtype=np.float64)
+        self.volatilities = np.asarray(volatilities, dtype=np.float64)
+        self.current_values = self.base_values.copy()
         self.time_index = 0
+        self._rng = np.random.default_rng(seed)
 
-    def get_next_value(self):
+    def get_next_values(self):
         """
-        Genera un valore successivo con andamento realistico
+        Genera i valori successivi di tutti i sensori con andamento realistico
         Simula variazioni cicliche e casuali
         """
         # Componente ciclica (simula variazioni giornaliere/orarie)
-        cycle_factor = math.sin(self.time_index * 0.5) * 0.3
-
-        # Componente casuale
-        random_factor = random.uniform(-self.volatility, self.volatility)
+        cycle_factor = _fast_sin(self.time_index * 0.5) * 0.3
 
-        # Calcolo del nuovo valore
-        new_value = self.current_value + cycle_factor + random_factor
+        # Componente casuale, un'estrazione vettoriale per tutti i sensori
+        random_factors = self._rng.uniform(-self.volatilities, self.volatilities)
 
-        # Mantieni il valore entro i limiti
-        new_value = max(self.min_value, min(new_value, self.max_value))
-
-        # Aggiorna stato
-        self.current_value = new_value
+        # Nuovi valori, mantenuti entro i limiti
+        self.current_values = np.clip(
+            self.current_values + cycle_factor + random_factors,
+            self.min_values, self.max_values
+        )
         self.time_index += 1
 
-        return round(new_value, 2)
+        return np.round(self.current_values, 2)
 
 class HydroponicDataLogger:
     def __init__(self, canister_id='ljyqf-uqaaa-aaaag-atzmq-cai', identity_path=None):
         # Configurazione dell'identità
         if identity_path is None:
             identity_path = os.path.expanduser("~/icp_identity.pem")
-        
+
         self.identity_path = identity_path
-        self.identity = self._load_or_create_identity()
-        
+
         # ID del canister
         self.canister_id = canister_id
 
-        # Configura il client e l'agent
+        # Configura il client
         self.client = Client(url="https://icp0.io")
-        self.agent = Agent(client=self.client, identity=self.identity)
+
+        # Carica l'identità in background: file I/O e generazione della
+        # chiave si sovrappongono alla preparazione delle prime letture.
+        # Lo stesso pool esegue gli invii al canister fuori dal ciclo
+        # principale
+        self._executor = ThreadPoolExecutor(max_workers=2)
+        self._identity_future = self._executor.submit(self._load_or_create_identity)
+        self._agent = None
+
+    @property
+    def identity(self):
+        return self._identity_future.result()
+
+    @property
+    def agent(self):
+        # Costruito al primo invio, quando l'identità è pronta
+        if self._agent is None:
+            self._agent = Agent(client=self.client, identity=self.identity)
+        return self._agent
 
     def _load_or_create_identity(self):
         """
@@ -132,43 +165,91 @@ class HydroponicDataLogger:
             print(f"Errore durante l'inserimento della lettura {entity_id}: {e}")
             return None
 
+    def insert_readings(self, batch):
+        """
+        Inserisce un blocco di letture nel canister con una sola chiamata
+        """
+        try:
+            # Codifica tutte le coppie (entity, value) in un unico argomento Candid
+            batch_type = Types.Vec(Types.Record({
+                'entity': Types.Text,
+                'value': Types.Float64
+            }))
+            params = [
+                {'type': batch_type, 'value': batch}
+            ]
+
+            encoded_args = encode(params)
+
+            # Chiamata unica per l'intero blocco
+            result = self.agent.update_raw(
+                canister_id=self.canister_id,
+                method_name="insertReadings",
+                arg=encoded_args
+            )
+
+            print(f"Inserite {len(batch)} letture in una sola chiamata")
+            return result
+
+        except Exception as e:
+            print(f"Errore durante l'inserimento del blocco di letture: {e}")
+            return None
+
+    def insert_readings_async(self, batch):
+        """
+        Invia un blocco di letture da un thread di background
+
+        Restituisce un Future: il ciclo principale può continuare a
+        generare letture mentre la chiamata al canister è in corso
+        """
+        return self._executor.submit(self.insert_readings, batch)
+
+class ReadingBatcher:
+    """
+    Accumula letture e le invia in blocco al canister
+
+    Svuota il buffer quando raggiunge max_size letture oppure quando la
+    lettura piu' vecchia aspetta da piu' di flush_seconds
+    """
+    def __init__(self, logger, max_size=8, flush_seconds=1.0):
+        self.logger = logger
+        self.max_size = max_size
+        self.flush_seconds = flush_seconds
+        self._buffer = []
+        self._oldest = None
+
+    def add(self, entity_id, value):
+        if not self._buffer:
+            self._oldest = time.monotonic()
+        self._buffer.append({'entity': str(entity_id), 'value': float(value)})
+
+        if (len(self._buffer) >= self.max_size
+                or time.monotonic() - self._oldest >= self.flush_seconds):
+            return self.flush()
+        return None
+
+    def flush(self):
+        if not self._buffer:
+            return None
+        batch = self._buffer
+        self._buffer = []
+        self._oldest = None
+        return self.logger.insert_readings_async(batch)
+
 def main():
     # Crea il logger
     logger = HydroponicDataLogger()
     
-    # Crea sensori con parametri realistici
-    # Entity 11: EC (µS/cm)
-    ec_sensor = HydroponicDataSensor(
-        base_value=1850,  # Valore medio µS/cm
-        min_value=1200,   # Minimo per colture idroponiche
-        max_value=2500,   # Massimo per colture idroponiche
-        volatility=50     # Variazione moderata
-    )
-
-    # Entity 12: pH
-    ph_sensor = HydroponicDataSensor(
-        base_value=6.0,   # pH ottimale
-        min_value=5.5,    # Limite inferiore
-        max_value=6.5,    # Limite superiore
-        volatility=0.2    # Bassa volatilità
-    )
-
-    # Entity 13: Temperatura (°C)
-    temp_sensor = HydroponicDataSensor(
-        base_value=22.5,  # Temperatura media ottimale
-        min_value=20,     # Minimo tollerabile
-        max_value=25,     # Massimo tollerabile
-        volatility=0.5    # Moderata variazione
+    # Crea il banco di sensori con parametri realistici
+    # Entity 11: EC (µS/cm), 12: pH, 13: Temperatura (°C), 14: Umidità (%)
+    entity_ids = ("11", "12", "13", "14")
+    sensors = SensorBank(
+        base_values=(1850, 6.0, 22.5, 65),   # Valori medi ottimali
+        min_values=(1200, 5.5, 20, 60),      # Limiti inferiori
+        max_values=(2500, 6.5, 25, 70),      # Limiti superiori
+        volatilities=(50, 0.2, 0.5, 2)       # Variazioni moderate
     )
 
-    # Entity 14: Umidità (%)
-    humidity_sensor = HydroponicDataSensor(
-        base_value=65,    # Umidità media ottimale
-        min_value=60,     # Minimo
-        max_value=70,     # Massimo
-        volatility=2      # Variazione moderata
-    )
-    
     # Tempo totale di logging: 1 ora
     total_duration = timedelta(hours=1)
     start_time = datetime.now()
@@ -177,14 +258,17 @@ def main():
     print(f"Inizio logging dati idroponici: {start_time}")
     print(f"Fine logging: {end_time}")
 
+    # Accumula le quattro letture del ciclo in un'unica chiamata al canister
+    batcher = ReadingBatcher(logger, max_size=4)
+
     # Ciclo di inserimento dati ogni 5 minuti
     while datetime.now() < end_time:
         try:
-            # Genera e inserisce letture
-            logger.insert_reading("11", ec_sensor.get_next_value())
-            logger.insert_reading("12", ph_sensor.get_next_value())
-            logger.insert_reading("13", temp_sensor.get_next_value())
-            logger.insert_reading("14", humidity_sensor.get_next_value())
+            # Genera e accoda le letture, poi invia il blocco
+            values = sensors.get_next_values()
+            for entity_id, value in zip(entity_ids, values):
+                batcher.add(entity_id, value)
+            batcher.flush()
 
             # Attendi 5 minuti prima del prossimo inserimento
             time.sleep(300)  # 300 secondi = 5 minuti